@@ -1,29 +1,174 @@
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify, stream_with_context, url_for
+from blinker import Namespace
+import click
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy import and_, or_, event, func, inspect, text, update
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import contains_eager
+from datetime import datetime, timedelta, timezone
 import qrcode
 import qrcode.constants
+import qrcode.image.svg
 import json
+import functools
+import hashlib
+import hmac
+import struct
+import statistics
 import io
 import base64
 import uuid
+import os
 import re
+import secrets
+import sqlite3
+import atexit
+import csv
+import multiprocessing
+import queue
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import time
 from werkzeug.security import generate_password_hash, check_password_hash
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from PIL import Image
 
 # Create Flask app
 app = Flask(__name__)
 
 # Configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///attendease.db'
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+if not app.config['SECRET_KEY']:
+    # Never fall back to a known key: sign with a random one that dies with this process
+    app.config['SECRET_KEY'] = secrets.token_hex(32)
+    print("⚠️ WARNING: SECRET_KEY is not set; using a random per-process key. "
+          "Access tokens and QR codes stop working on restart and are not shared between workers.")
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///attendease.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', 'production')
+app.config['DB_POOL_SIZE'] = env_int('DB_POOL_SIZE', 10)
+app.config['DB_MAX_OVERFLOW'] = env_int('DB_MAX_OVERFLOW', 20)
+app.config['DB_POOL_TIMEOUT'] = env_int('DB_POOL_TIMEOUT', 30)
+app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', '1') != '0'
+app.config['DB_POOL_RECYCLE'] = env_int('DB_POOL_RECYCLE', 1800)
+app.config['DB_STATEMENT_TIMEOUT_MS'] = env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+app.config['RECORDS_PAGE_SIZE'] = 20
+app.config['RECORDS_MAX_PAGE_SIZE'] = 100
+app.config['BULK_ATTENDANCE_MAX_ITEMS'] = 5000
+app.config['BULK_INSERT_CHUNK_ROWS'] = 1000
+app.config['OFFLINE_SYNC_MAX_SCANS'] = 50
+app.config['OFFLINE_CLOCK_SKEW_SECONDS'] = 120
+app.config['OFFLINE_SYNC_ALLOWANCE_SECONDS'] = 60
+app.config['ACTIVE_SESSION_CACHE_TTL'] = 300
+app.config['ACTIVE_SESSION_CACHE_SIZE'] = 1024
+app.config['ACCESS_TOKEN_MAX_AGE'] = env_int('ACCESS_TOKEN_MAX_AGE', 12 * 3600)
+app.config['ACCESS_TOKEN_CACHE_SIZE'] = 10000
+app.config['SESSION_VIEW_TOKEN_MAX_AGE'] = 600
+app.config['IDEMPOTENCY_TTL'] = 3600
+app.config['STUDENT_IMPORT_BATCH_SIZE'] = 500
+app.config['IDEMPOTENCY_CACHE_SIZE'] = 10000
+app.config['IDEMPOTENCY_WAIT_SECONDS'] = 10
+app.config['ATTENDANCE_WRITE_BEHIND'] = False
+app.config['ATTENDANCE_FLUSH_INTERVAL_MS'] = 50
+app.config['ATTENDANCE_FLUSH_MAX_ROWS'] = 500
+app.config['ATTENDANCE_QUEUE_MAX_SIZE'] = 10000
+app.config['ATTENDANCE_FLUSH_MAX_RETRIES'] = 5
+app.config['ATTENDANCE_FLUSH_RETRY_DELAY_MS'] = 100
+app.config['QR_CACHE_SIZE'] = 256
+app.config['QR_MASK_PATTERN'] = 0
+app.config['QR_IMAGE_MAX_AGE'] = 3600
+app.config['SESSION_LIFETIME_MINUTES'] = env_int('SESSION_LIFETIME_MINUTES', 120)
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = env_int('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)
+app.config['PASSWORD_HASH_MAX_PENDING'] = env_int('PASSWORD_HASH_MAX_PENDING', 4 * (os.cpu_count() or 1))
+app.config['PASSWORD_HASH_BULK_MAX_PENDING'] = env_int('PASSWORD_HASH_BULK_MAX_PENDING', max(1, (os.cpu_count() or 1) // 2))
+app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = 10
+app.config['SESSION_SWEEP_INTERVAL'] = 60
+app.config['SESSION_CLOSE_GRACE_SECONDS'] = 30
+app.config['SESSION_REUSE_WINDOW_MINUTES'] = 15
+app.config['ROSTER_REFRESH_SECONDS'] = 300
+app.config['SSE_MAX_SUBSCRIBERS'] = 500
+app.config['SSE_HEARTBEAT_SECONDS'] = 15
+app.config['SSE_MAX_STREAM_SECONDS'] = 300
+app.config['SSE_RETRY_MS'] = 2000
+app.config['SSE_POLL_SECONDS'] = 1.0
+app.config['SSE_POLL_LOOKBACK_SECONDS'] = 10
+app.config['QR_TOKEN_MAX_AGE'] = app.config['SESSION_LIFETIME_MINUTES'] * 60
+app.config['QR_LEGACY_ACCEPT_UNTIL'] = os.environ.get('QR_LEGACY_ACCEPT_UNTIL')
+app.config['QR_ROTATION_SECONDS'] = 10
+app.config['QR_ROTATION_GRACE_FRAMES'] = 1
+app.config['QR_PRERENDER_FRAMES'] = 2
+app.config['QR_RENDER_WORKERS'] = 2
+app.config['QR_ROTATION_IDLE_SECONDS'] = 300
+
+# PRAGMAs applied to every new SQLite connection, per profile
+SQLITE_PROFILES = {
+    'default': {},
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -64000,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY'
+    }
+}
+
+def build_engine_options(config):
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = {
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE']
+    }
+    
+    # In-memory SQLite runs on a single static connection, so there is no pool to size
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return options
+    
+    options.update({
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT']
+    })
+    
+    # SQLite has no statement timeout; busy_timeout in the profile covers lock waits
+    if url.get_backend_name() == 'postgresql' and config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return options
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(app.config)
 
 # Initialize extensions
 db = SQLAlchemy(app)
 CORS(app)
 
+@event.listens_for(Engine, 'connect')
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PROFILES[app.config['SQLITE_PROFILE']].items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
 # Database Models
+def utcnow():
+    return datetime.now(timezone.utc)
+
+# Session ids are uuid4 strings; PostgreSQL stores them as native UUID
+SessionId = db.String(36).with_variant(postgresql.UUID(as_uuid=False), 'postgresql')
+
 class Teacher(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     fullname = db.Column(db.String(100), nullable=False)
@@ -33,10 +178,10 @@ class Teacher(db.Model):
     emp_id = db.Column(db.String(50), unique=True, nullable=False)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
 class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -49,41 +194,1399 @@ class Student(db.Model):
     section = db.Column(db.String(20), nullable=False)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
 class Subject(db.Model):
+    __table_args__ = (
+        db.Index('ix_subject_teacher_name', 'teacher_id', 'name'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id'), nullable=False)
 
 class AttendanceSession(db.Model):
-    id = db.Column(db.String(50), primary_key=True)
+    __table_args__ = (
+        db.Index('ix_attendance_session_teacher_created', 'teacher_id', 'created_at'),
+        # Only sessions still open, so the expiry sweep never scans closed history
+        db.Index(
+            'ix_attendance_session_active_created', 'created_at',
+            sqlite_where=db.text('is_active = 1'),
+            postgresql_where=db.text('is_active')
+        ),
+    )
+    
+    id = db.Column(SessionId, primary_key=True)
     teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id'), nullable=False)
     subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
     class_section = db.Column(db.String(50), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime(timezone=True), default=utcnow)
     is_active = db.Column(db.Boolean, default=True)
+    # 'static' or 'rotating' (projector mode); NULL for sessions created before signed QR codes
+    qr_mode = db.Column(db.String(10))
+    # Written when the session closes: the section roster, who scanned as a bitset over it,
+    # and the ids of students outside the roster who scanned anyway
+    roster_ids = db.Column(db.LargeBinary)
+    present_bitmap = db.Column(db.LargeBinary)
+    present_outside_ids = db.Column(db.LargeBinary)
+
+    teacher = db.relationship('Teacher')
+    subject = db.relationship('Subject')
 
 class Attendance(db.Model):
+    __table_args__ = (
+        db.Index('ux_attendance_session_student', 'session_id', 'student_id', unique=True),
+        db.Index('ix_attendance_student_marked', 'student_id', 'marked_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.String(50), db.ForeignKey('attendance_session.id'), nullable=False)
+    session_id = db.Column(SessionId, db.ForeignKey('attendance_session.id'), nullable=False)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
-    marked_at = db.Column(db.DateTime, default=datetime.utcnow)
+    marked_at = db.Column(db.DateTime(timezone=True), default=utcnow)
+
+    session = db.relationship('AttendanceSession')
+    student = db.relationship('Student')
+
+# Migrations
+def migrate_database():
+    db.create_all()
+    
+    # Databases created before the unique index may hold duplicate scans; keep the first one
+    existing_indexes = {index['name'] for index in inspect(db.engine).get_indexes('attendance')}
+    if 'ux_attendance_session_student' not in existing_indexes:
+        first_ids = db.session.query(func.min(Attendance.id)).group_by(
+            Attendance.session_id, Attendance.student_id
+        )
+        removed = Attendance.query.filter(Attendance.id.not_in(first_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        if removed:
+            print(f"🧹 Removed {removed} duplicate attendance rows")
+    
+    # create_all() skips tables that already exist, so add their missing (nullable) columns
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                print(f"🧱 Added column {table.name}.{column.name}")
+    db.session.commit()
+    
+    # ... and their missing indexes
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    migrate_database()
+    print("✅ Database migrated successfully!")
+
+# Active sessions seen recently, so repeated scans skip the session lookup.
+# Bounded LRU with a TTL; entries are dropped when a session closes or expires.
+class ActiveSessionCache:
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+    
+    def get(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            expires_at, session_info = entry
+            if expires_at < time.monotonic():
+                del self._entries[session_id]
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self._stats['hits'] += 1
+            return session_info
+    
+    def put(self, session_id, session_info):
+        with self._lock:
+            self._entries[session_id] = (time.monotonic() + self.ttl, session_info)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+    
+    def discard(self, session_id):
+        with self._lock:
+            if self._entries.pop(session_id, None) is not None:
+                self._stats['invalidations'] += 1
+    
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+active_sessions = ActiveSessionCache(
+    app.config['ACTIVE_SESSION_CACHE_TTL'],
+    app.config['ACTIVE_SESSION_CACHE_SIZE']
+)
+
+def session_info_for(session):
+    return {
+        'id': session.id,
+        'teacher_id': session.teacher_id,
+        'subject_id': session.subject_id,
+        'class_section': session.class_section,
+        'qr_mode': session.qr_mode,
+        'created_at': session.created_at
+    }
+
+def get_active_session(session_id):
+    try:
+        uuid.UUID(session_id)
+    except (TypeError, ValueError):
+        return None
+    
+    session_info = active_sessions.get(session_id)
+    if session_info is not None:
+        if session_expired(session_info['created_at']):
+            active_sessions.discard(session_id)
+            return None
+        return session_info
+    
+    # Sessions past their lifetime count as closed even before the sweeper reaches them
+    session = AttendanceSession.query.filter(
+        AttendanceSession.id == session_id,
+        AttendanceSession.is_active == True,
+        AttendanceSession.created_at >= utcnow() - session_lifetime()
+    ).first()
+    if not session:
+        return None
+    
+    session_info = session_info_for(session)
+    active_sessions.put(session_id, session_info)
+    return session_info
+
+# Session expiry
+def session_lifetime():
+    return timedelta(minutes=app.config['SESSION_LIFETIME_MINUTES'])
+
+def session_expired(created_at, now=None):
+    return as_utc(created_at) + session_lifetime() <= (now or utcnow())
+
+def on_sessions_closed(session_ids):
+    for session_id in session_ids:
+        active_sessions.discard(session_id)
+        rotating_qr.discard(session_id)
+
+def expire_sessions(now=None):
+    # Another process may already have closed them in the database
+    live_attendance.evict_expired(now)
+    
+    # Scans stop being accepted at the end of the lifetime; the grace lets writes already
+    # accepted (in flight or in the write-behind queue) land before the bitset is built
+    cutoff = (now or utcnow()) - session_lifetime() - timedelta(seconds=app.config['SESSION_CLOSE_GRACE_SECONDS'])
+    expired = db.session.query(AttendanceSession.id, AttendanceSession.class_section).filter(
+        AttendanceSession.is_active == True,
+        AttendanceSession.created_at < cutoff
+    ).all()
+    if not expired:
+        return []
+    
+    # Close them in one executemany, persisting each session's attendance bitset
+    bitsets = live_attendance.close(expired)
+    db.session.execute(update(AttendanceSession), [
+        {
+            'id': session_id,
+            'is_active': False,
+            'roster_ids': pack_student_ids(state['roster']),
+            'present_bitmap': state['bits'].to_bytes((len(state['roster']) + 7) // 8, 'little'),
+            'present_outside_ids': pack_student_ids(sorted(state['others']))
+        }
+        for session_id, state in bitsets.items()
+    ])
+    db.session.commit()
+    
+    expired_ids = list(bitsets)
+    on_sessions_closed(expired_ids)
+    return expired_ids
+
+class SessionExpirySweeper:
+    def __init__(self, interval):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='session-sweeper', daemon=True)
+            self._thread.start()
+        atexit.register(self._stop.set)
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with app.app_context():
+                try:
+                    expired_ids = expire_sessions()
+                    if expired_ids:
+                        print(f"⏰ Closed {len(expired_ids)} expired sessions")
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"❌ Session sweep failed: {e}")
+
+session_sweeper = SessionExpirySweeper(app.config['SESSION_SWEEP_INTERVAL'])
+
+@app.before_request
+def start_background_workers():
+    session_sweeper.start()
+    live_scan_poller.start()
+
+@app.cli.command('expire-sessions')
+def expire_sessions_command():
+    expired_ids = expire_sessions()
+    print(f"✅ Closed {len(expired_ids)} expired sessions")
+
+# Section rosters: each section maps to a sorted array of student ids. Sections are
+# free text on both sides, so they are matched after trimming and case folding.
+def normalize_section(section):
+    return ' '.join(section.split()).casefold()
+
+def pack_student_ids(student_ids):
+    packed = array('I', student_ids)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+def unpack_student_ids(data):
+    student_ids = array('I')
+    student_ids.frombytes(data or b'')
+    if sys.byteorder == 'big':
+        student_ids.byteswap()
+    return student_ids
+
+class RosterIndex:
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._rosters = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+    
+    def roster(self, section):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+                self._load()
+            return array('I', self._rosters.get(normalize_section(section), ()))
+    
+    def add_student(self, student_id, section):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            student_ids = self._rosters.setdefault(normalize_section(section), array('I'))
+            position = bisect_left(student_ids, student_id)
+            if position == len(student_ids) or student_ids[position] != student_id:
+                student_ids.insert(position, student_id)
+    
+    def _load(self):
+        rosters = {}
+        for student_id, section in db.session.query(Student.id, Student.section).order_by(Student.id):
+            rosters.setdefault(normalize_section(section), array('I')).append(student_id)
+        self._rosters = rosters
+        self._loaded_at = time.monotonic()
+
+roster_index = RosterIndex(app.config['ROSTER_REFRESH_SECONDS'])
+
+# Who has scanned into each open session, as a bitset over the section roster taken
+# when tracking started. Students outside the roster are kept in a small side set.
+# This is a per-process cache for live counts only: with several workers each one sees
+# just its own scans, so anything persisted is rebuilt from the attendance table. Entries
+# leave when this process closes the session or, at the latest, when its lifetime ends.
+class LiveAttendance:
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+    
+    def open(self, session_id, class_section, created_at):
+        with self._lock:
+            if session_id in self._sessions:
+                return
+        state = self._new_state(class_section)
+        state['created_at'] = as_utc(created_at)
+        scanned = db.session.query(Attendance.student_id).filter(Attendance.session_id == session_id)
+        for (student_id,) in scanned:
+            self._set(state, student_id)
+        with self._lock:
+            self._sessions.setdefault(session_id, state)
+    
+    def mark(self, session_id, student_id):
+        # True when this process had not seen the student in this session yet
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                return False
+            return self._set(state, int(student_id))
+    
+    def close(self, sessions):
+        # Takes (session_id, class_section) pairs; returns {session_id: state} built from the
+        # attendance table in one IN query, never from this process's in-memory view
+        with self._lock:
+            for session_id, _ in sessions:
+                self._sessions.pop(session_id, None)
+        states = {session_id: self._new_state(section) for session_id, section in sessions}
+        scanned = db.session.query(Attendance.session_id, Attendance.student_id).filter(
+            Attendance.session_id.in_(list(states))
+        )
+        for session_id, student_id in scanned:
+            self._set(states[session_id], student_id)
+        return states
+    
+    def evict_expired(self, now=None):
+        # Sessions past their lifetime leave the cache whether or not this process closed them
+        with self._lock:
+            expired = [
+                session_id for session_id, state in self._sessions.items()
+                if session_expired(state['created_at'], now)
+            ]
+            for session_id in expired:
+                del self._sessions[session_id]
+        return expired
+    
+    def present_count(self, session_id):
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                return None
+            return bin(state['bits']).count('1') + len(state['others'])
+    
+    def metrics(self):
+        with self._lock:
+            return {'open_sessions': len(self._sessions)}
+    
+    def _new_state(self, class_section):
+        return {'roster': roster_index.roster(class_section), 'bits': 0, 'others': set()}
+    
+    def _set(self, state, student_id):
+        roster = state['roster']
+        position = bisect_left(roster, student_id)
+        if position < len(roster) and roster[position] == student_id:
+            if state['bits'] >> position & 1:
+                return False
+            state['bits'] |= 1 << position
+        else:
+            if student_id in state['others']:
+                return False
+            state['others'].add(student_id)
+        return True
+
+live_attendance = LiveAttendance()
+
+# Live scan feed: the write paths publish their own scans right after commit, and
+# LiveScanPoller picks up scans committed by other processes from the attendance table;
+# either way scan_accepted fires once per scan per process (LiveAttendance remembers who
+# was announced). The hub fans each event out to the per-client queues of that session's
+# SSE streams. Streams only wait on their queue, so idle subscribers cost no database
+# work; gunicorn.conf.py runs gevent workers so a waiting stream holds a greenlet.
+attendance_signals = Namespace()
+scan_accepted = attendance_signals.signal('scan-accepted')
+
+class LiveScanHub:
+    def __init__(self, max_subscribers):
+        self.max_subscribers = max_subscribers
+        self._subscribers = {}
+        self._count = 0
+        self._lock = threading.Lock()
+    
+    def has_subscribers(self, session_id):
+        return session_id in self._subscribers
+    
+    def session_ids(self):
+        with self._lock:
+            return list(self._subscribers)
+    
+    def subscribe(self, session_id):
+        # Returns a queue of events, or None when the hub is full
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            events = queue.Queue(maxsize=100)
+            self._subscribers.setdefault(session_id, set()).add(events)
+            self._count += 1
+            return events
+    
+    def unsubscribe(self, session_id, events):
+        with self._lock:
+            subscribers = self._subscribers.get(session_id)
+            if subscribers is None or events not in subscribers:
+                return
+            subscribers.discard(events)
+            self._count -= 1
+            if not subscribers:
+                del self._subscribers[session_id]
+    
+    def on_scan(self, sender, session_id, events):
+        with self._lock:
+            subscribers = list(self._subscribers.get(session_id, ()))
+        for subscriber in subscribers:
+            for scan in events:
+                try:
+                    subscriber.put_nowait(scan)
+                except queue.Full:
+                    break
+    
+    def metrics(self):
+        with self._lock:
+            return {'subscribers': self._count, 'sessions': len(self._subscribers)}
+
+live_scan_hub = LiveScanHub(app.config['SSE_MAX_SUBSCRIBERS'])
+scan_accepted.connect(live_scan_hub.on_scan)
+
+def publish_scans(session_id, scans):
+    # scans: (student_id, marked_at) pairs already committed. Marks them live and sends
+    # the ones this process has not announced yet
+    scans = [(int(student_id), marked_at) for student_id, marked_at in scans if live_attendance.mark(session_id, student_id)]
+    if not scans or not live_scan_hub.has_subscribers(session_id):
+        return
+    students = {
+        student.id: student for student in db.session.query(Student.id, Student.fullname, Student.roll_no).filter(
+            Student.id.in_([student_id for student_id, _ in scans])
+        )
+    }
+    count = live_attendance.present_count(session_id)
+    events = []
+    for student_id, marked_at in scans:
+        student = students.get(student_id)
+        if student is not None:
+            events.append({
+                'name': student.fullname,
+                'roll_no': student.roll_no,
+                'time': as_utc(marked_at).strftime('%H:%M:%S'),
+                'count': count
+            })
+    if events:
+        scan_accepted.send(app, session_id=session_id, events=events)
+
+# Polls the attendance table for the sessions this process streams, one query per interval
+# for all of them. Ids are re-read for SSE_POLL_LOOKBACK_SECONDS, since on PostgreSQL a row
+# can commit after one with a higher id; rows already announced are skipped by publish_scans.
+class LiveScanPoller:
+    def __init__(self, interval, lookback_seconds):
+        self.interval = interval
+        self._high_water = deque(maxlen=max(1, int(lookback_seconds / interval)) + 1)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='live-scan-poller', daemon=True)
+            self._thread.start()
+        atexit.register(self._stop.set)
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            session_ids = live_scan_hub.session_ids()
+            if not session_ids:
+                continue
+            with app.app_context():
+                try:
+                    self.poll(session_ids)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"❌ Live scan poll failed: {e}")
+    
+    def poll(self, session_ids):
+        if not self._high_water:
+            self._high_water.append(db.session.query(func.max(Attendance.id)).scalar() or 0)
+        rows = db.session.query(
+            Attendance.id, Attendance.session_id, Attendance.student_id, Attendance.marked_at
+        ).filter(
+            Attendance.session_id.in_(session_ids),
+            Attendance.id > self._high_water[0]
+        ).order_by(Attendance.id).all()
+        db.session.rollback()
+        
+        self._high_water.append(max([self._high_water[-1]] + [row.id for row in rows]))
+        scans_by_session = {}
+        for row in rows:
+            scans_by_session.setdefault(row.session_id, []).append((row.student_id, row.marked_at))
+        for session_id, scans in scans_by_session.items():
+            publish_scans(session_id, scans)
+
+live_scan_poller = LiveScanPoller(app.config['SSE_POLL_SECONDS'], app.config['SSE_POLL_LOOKBACK_SECONDS'])
+
+# INSERT that silently skips rows violating a unique index, in the backend's dialect
+def insert_ignoring_duplicates(model, index_elements):
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing(index_elements=index_elements)
+    if dialect == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing(index_elements=index_elements)
+    # MySQL / MariaDB
+    return db.insert(model).prefix_with('IGNORE')
+
+# Write-behind queue: scans are acknowledged at once and bulk-inserted by a background flusher.
+# Scans were already answered with 202, so a failed flush is retried with backoff; after
+# the last retry rows are written one by one and only the ones that still fail are dropped.
+class AttendanceWriteQueue:
+    def __init__(self, flush_interval_ms, flush_max_rows, max_size, max_retries, retry_delay_ms):
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_rows = flush_max_rows
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay_ms / 1000
+        self._queue = queue.Queue(maxsize=max_size)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {
+            'flushes': 0,
+            'rows_flushed': 0,
+            'flush_errors': 0,
+            'flush_retries': 0,
+            'rows_dropped': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0
+        }
+    
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='attendance-flusher', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+    
+    def submit(self, session_id, student_id):
+        # Returns False if the same scan is already waiting to be flushed; raises queue.Full
+        self.start()
+        key = (session_id, student_id)
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+        
+        try:
+            self._queue.put_nowait({
+                'session_id': session_id,
+                'student_id': student_id,
+                'marked_at': utcnow()
+            })
+        except queue.Full:
+            with self._lock:
+                self._pending.discard(key)
+            raise
+        return True
+    
+    def stop(self, timeout=5):
+        # Let the flusher drain whatever is still queued, then exit
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_flush_ms'] = stats['total_flush_ms'] / stats['flushes'] if stats['flushes'] else 0.0
+        return stats
+    
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+    
+    def _take_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_max_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _write(self, rows):
+        # Returns None on success, otherwise the exception
+        with app.app_context():
+            try:
+                db.session.execute(insert_ignoring_duplicates(Attendance, ['session_id', 'student_id']), rows)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                return e
+            
+            scans_by_session = {}
+            for row in rows:
+                scans_by_session.setdefault(row['session_id'], []).append((row['student_id'], row['marked_at']))
+            for session_id, scans in scans_by_session.items():
+                publish_scans(session_id, scans)
+        return None
+    
+    def _flush(self, batch):
+        started = time.perf_counter()
+        written = len(batch)
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            error = self._write(batch)
+            if error is None:
+                break
+            print(f"❌ Attendance flush of {len(batch)} rows failed (attempt {attempt + 1}): {error}")
+            with self._lock:
+                self._stats['flush_errors'] += 1
+                if attempt < self.max_retries:
+                    self._stats['flush_retries'] += 1
+            if attempt < self.max_retries:
+                time.sleep(delay)
+                delay = min(delay * 2, 2.0)
+        else:
+            # Keep the rows that can be written; drop only the ones that keep failing
+            written = 0
+            for row in batch:
+                error = self._write([row])
+                if error is None:
+                    written += 1
+                else:
+                    print(f"❌ Dropped scan of student {row['student_id']} for session {row['session_id']}: {error}")
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        
+        with self._lock:
+            self._pending.difference_update((row['session_id'], row['student_id']) for row in batch)
+            self._stats['rows_dropped'] += len(batch) - written
+            if not written:
+                return
+            self._stats['flushes'] += 1
+            self._stats['rows_flushed'] += written
+            self._stats['last_flush_ms'] = elapsed_ms
+            self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], elapsed_ms)
+            self._stats['total_flush_ms'] += elapsed_ms
+
+attendance_writer = AttendanceWriteQueue(
+    app.config['ATTENDANCE_FLUSH_INTERVAL_MS'],
+    app.config['ATTENDANCE_FLUSH_MAX_ROWS'],
+    app.config['ATTENDANCE_QUEUE_MAX_SIZE'],
+    app.config['ATTENDANCE_FLUSH_MAX_RETRIES'],
+    app.config['ATTENDANCE_FLUSH_RETRY_DELAY_MS']
+)
+
+# Password hashing runs in a process pool so slow KDFs use every core instead of holding
+# the GIL in request threads. At most PASSWORD_HASH_MAX_PENDING hashes run or wait at
+# once; beyond that callers get PasswordHasherBusy. Bulk imports also draw every hash from
+# a smaller PASSWORD_HASH_BULK_MAX_PENDING budget, so they never crowd out logins.
+# PASSWORD_HASH_WORKERS=0 hashes inline.
+# Hashes made under an older PASSWORD_HASH_METHOD are upgraded on the next login.
+class PasswordHasherBusy(Exception):
+    pass
+
+class PasswordHasher:
+    def __init__(self, method, workers, max_pending, bulk_max_pending, queue_timeout):
+        self.method = method
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._bulk_slots = threading.BoundedSemaphore(bulk_max_pending)
+        self._executor = None
+        self._policy_prefix = None
+        self._lock = threading.Lock()
+        self._stats = {'hashes': 0, 'verifies': 0, 'rehashes': 0, 'busy_rejections': 0}
+    
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: workers must not inherit the parent's threads or database connections
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                atexit.register(self._executor.shutdown, wait=False, cancel_futures=True)
+            return self._executor
+    
+    def _acquire_slot(self):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self._stats['busy_rejections'] += 1
+            raise PasswordHasherBusy()
+    
+    def _run(self, fn, *args):
+        self._acquire_slot()
+        try:
+            if self.workers <= 0:
+                return fn(*args)
+            return self._get_executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+    
+    def _release_bulk_slot(self, future):
+        self._slots.release()
+        self._bulk_slots.release()
+    
+    def hash_many(self, passwords):
+        # Every hash holds a bulk slot and a shared slot while it runs; the bulk budget
+        # makes an import wait for its own earlier hashes instead of filling the pool
+        if self.workers <= 0:
+            hashes = []
+            for password in passwords:
+                with self._bulk_slots:
+                    hashes.append(self._run(generate_password_hash, password, self.method))
+        else:
+            futures = []
+            try:
+                for password in passwords:
+                    self._bulk_slots.acquire()
+                    try:
+                        self._acquire_slot()
+                    except PasswordHasherBusy:
+                        self._bulk_slots.release()
+                        raise
+                    try:
+                        future = self._get_executor().submit(generate_password_hash, password, self.method)
+                    except Exception:
+                        self._release_bulk_slot(None)
+                        raise
+                    future.add_done_callback(self._release_bulk_slot)
+                    futures.append(future)
+                hashes = [future.result() for future in futures]
+            except BaseException:
+                # Cancelled hashes release their slots through the done callback
+                for future in futures:
+                    future.cancel()
+                raise
+        with self._lock:
+            self._stats['hashes'] += len(hashes)
+        return hashes
+    
+    def hash(self, password):
+        pwhash = self._run(generate_password_hash, password, self.method)
+        with self._lock:
+            self._stats['hashes'] += 1
+        return pwhash
+    
+    def verify(self, pwhash, password):
+        matches = self._run(check_password_hash, pwhash, password)
+        with self._lock:
+            self._stats['verifies'] += 1
+        return matches
+    
+    def needs_rehash(self, pwhash):
+        # Werkzeug hashes look like "<method:params>$<salt>$<hash>"
+        if self._policy_prefix is None:
+            self._policy_prefix = self._run(generate_password_hash, '', self.method).split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._policy_prefix
+    
+    def note_rehash(self):
+        with self._lock:
+            self._stats['rehashes'] += 1
+    
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['workers'] = self.workers
+        stats['method'] = self.method
+        return stats
+
+password_hasher = PasswordHasher(
+    app.config['PASSWORD_HASH_METHOD'],
+    app.config['PASSWORD_HASH_WORKERS'],
+    app.config['PASSWORD_HASH_MAX_PENDING'],
+    app.config['PASSWORD_HASH_BULK_MAX_PENDING'],
+    app.config['PASSWORD_HASH_QUEUE_TIMEOUT']
+)
+
+# QR rendering, cached per payload. PNGs are 1-bit with one pixel per module;
+# the browser scales them up (image-rendering: pixelated) instead of the server.
+# A fixed QR_MASK_PATTERN skips scoring all eight masks; None restores it.
+def make_qr(payload):
+    qr = qrcode.QRCode(
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        border=4,
+        mask_pattern=app.config['QR_MASK_PATTERN']
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr
+
+def draw_qr_png(payload):
+    matrix = make_qr(payload).get_matrix()
+    size = len(matrix)
+    img = Image.new('1', (size, size))
+    img.putdata([0 if dark else 1 for row in matrix for dark in row])
+    
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+@functools.lru_cache(maxsize=app.config['QR_CACHE_SIZE'])
+def render_qr_png(payload):
+    return draw_qr_png(payload)
+
+@functools.lru_cache(maxsize=app.config['QR_CACHE_SIZE'])
+def render_qr_svg(payload):
+    img = make_qr(payload).make_image(image_factory=qrcode.image.svg.SvgPathImage)
+    return img.to_string(encoding='unicode').encode()
+
+QR_RENDERERS = {
+    'png': (render_qr_png, 'image/png'),
+    'svg': (render_qr_svg, 'image/svg+xml')
+}
+
+# QR codes carry a compact signed token: 16-byte session uuid, 1-byte mode, 4-byte
+# unsigned expiry and an 8-byte HMAC, base45-encoded so the whole payload stays in QR alphanumeric mode and
+# fits a version 2 symbol (47 characters at most). Scans are checked with CPU work only.
+COMPACT_QR_PREFIX = 'AE2'
+BASE45_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+BASE45_VALUES = {char: value for value, char in enumerate(BASE45_ALPHABET)}
+
+qr_mac_key = hashlib.sha256(b'attendease-qr:' + app.config['SECRET_KEY'].encode()).digest()
+
+def base45_encode(data):
+    chars = []
+    for i in range(0, len(data), 2):
+        chunk = data[i:i + 2]
+        value = int.from_bytes(chunk, 'big')
+        for _ in range(3 if len(chunk) == 2 else 2):
+            value, digit = divmod(value, 45)
+            chars.append(BASE45_ALPHABET[digit])
+    return ''.join(chars)
+
+def base45_decode(text):
+    data = bytearray()
+    for i in range(0, len(text), 3):
+        chunk = text[i:i + 3]
+        if len(chunk) < 2:
+            raise ValueError('Invalid base45 length')
+        value = sum(BASE45_VALUES[char] * 45 ** position for position, char in enumerate(chunk))
+        size = 2 if len(chunk) == 3 else 1
+        if value >= 256 ** size:
+            raise ValueError('Invalid base45 chunk')
+        data += value.to_bytes(size, 'big')
+    return bytes(data)
+
+# Mode byte: a session's static code or one rotating projector frame
+QR_MODE_STATIC = 0
+QR_MODE_FRAME = 1
+
+def build_qr_payload(session_id, expires_at, rotating=False):
+    mode = QR_MODE_FRAME if rotating else QR_MODE_STATIC
+    body = uuid.UUID(session_id).bytes + struct.pack('>BI', mode, int(expires_at.timestamp()))
+    mac = hmac.new(qr_mac_key, body, hashlib.sha256).digest()[:8]
+    return COMPACT_QR_PREFIX + base45_encode(body + mac)
+
+def read_qr_payload(payload, now=None):
+    # Returns (session id, is rotating frame); raises BadSignature / SignatureExpired
+    if not payload.startswith(COMPACT_QR_PREFIX):
+        raise BadSignature('Invalid QR code')
+    try:
+        raw = base45_decode(payload[len(COMPACT_QR_PREFIX):])
+    except (KeyError, ValueError):
+        raise BadSignature('Invalid QR code')
+    body, mac = raw[:21], raw[21:]
+    if len(raw) != 29 or not hmac.compare_digest(mac, hmac.new(qr_mac_key, body, hashlib.sha256).digest()[:8]):
+        raise BadSignature('Invalid QR code')
+    session_id = str(uuid.UUID(bytes=body[:16]))
+    mode, expires = struct.unpack('>BI', body[16:])
+    if mode not in (QR_MODE_STATIC, QR_MODE_FRAME):
+        raise BadSignature('Invalid QR code')
+    rotating = mode == QR_MODE_FRAME
+    
+    now = now or utcnow()
+    if expires < now.timestamp():
+        raise SignatureExpired('QR code expired')
+    return session_id, rotating
+
+# Plain JSON QR codes (no signature) are refused unless QR_LEGACY_ACCEPT_UNTIL (ISO date)
+# opens a transition window; it ends on that fixed date, whatever restarts happen meanwhile.
+def legacy_qr_accepted(now=None):
+    until = app.config['QR_LEGACY_ACCEPT_UNTIL']
+    if not until:
+        return False
+    return (now or utcnow()) < as_utc(datetime.fromisoformat(until))
+
+# Fail at startup rather than on the first legacy scan if the date is malformed
+if app.config['QR_LEGACY_ACCEPT_UNTIL']:
+    datetime.fromisoformat(app.config['QR_LEGACY_ACCEPT_UNTIL'])
+
+def session_qr_payload(session):
+    expires_at = as_utc(session.created_at) + timedelta(seconds=app.config['QR_TOKEN_MAX_AGE'])
+    return build_qr_payload(session.id, expires_at)
+
+# Projector mode: the QR changes every QR_ROTATION_SECONDS. Each frame is a token that
+# expires shortly after its window (and never after the session); upcoming frames are
+# rendered ahead in a thread pool and each session keeps only a small ring of them in memory.
+class RotatingQRFrames:
+    def __init__(self, period, grace_frames, prerender_frames, workers, idle_seconds):
+        self.period = period
+        self.grace_frames = grace_frames
+        self.prerender_frames = prerender_frames
+        self.idle_seconds = idle_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='qr-render')
+        self._rings = {}
+        self._lock = threading.Lock()
+        atexit.register(self._executor.shutdown, wait=False)
+    
+    def current_frame(self, session_id, session_expires_at):
+        # Returns (png_bytes, seconds_until_next_frame)
+        now = time.time()
+        window = int(now // self.period)
+        with self._lock:
+            self._drop_idle()
+            ring = self._rings.get(session_id)
+            if ring is None:
+                ring = self._rings[session_id] = {
+                    'frames': deque(maxlen=self.prerender_frames + 1),
+                    'last_seen': 0
+                }
+            ring['last_seen'] = time.monotonic()
+            
+            while ring['frames'] and ring['frames'][0][0] < window:
+                ring['frames'].popleft()
+            next_window = ring['frames'][-1][0] + 1 if ring['frames'] else window
+            while next_window <= window + self.prerender_frames:
+                ring['frames'].append((next_window, self._executor.submit(
+                    draw_qr_png, self.frame_payload(session_id, next_window, session_expires_at)
+                )))
+                next_window += 1
+            future = ring['frames'][0][1]
+        
+        return future.result(), (window + 1) * self.period - now
+    
+    def frame_payload(self, session_id, window, session_expires_at):
+        expires_at = datetime.fromtimestamp((window + 1 + self.grace_frames) * self.period, timezone.utc)
+        return build_qr_payload(session_id, min(expires_at, session_expires_at), rotating=True)
+    
+    def discard(self, session_id):
+        with self._lock:
+            self._rings.pop(session_id, None)
+    
+    def _drop_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        for session_id in [sid for sid, ring in self._rings.items() if ring['last_seen'] < cutoff]:
+            del self._rings[session_id]
+
+rotating_qr = RotatingQRFrames(
+    app.config['QR_ROTATION_SECONDS'],
+    app.config['QR_ROTATION_GRACE_FRAMES'],
+    app.config['QR_PRERENDER_FRAMES'],
+    app.config['QR_RENDER_WORKERS'],
+    app.config['QR_ROTATION_IDLE_SECONDS']
+)
+
+@app.cli.command('bench-qr')
+@click.option('--iterations', default=200, help='Renders per pipeline')
+def bench_qr_command(iterations):
+    def legacy_render(payload):
+        qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
+        qr.add_data(payload)
+        qr.make(fit=True)
+        buffer = io.BytesIO()
+        qr.make_image(fill_color="black", back_color="white").save(buffer, format='PNG')
+        return base64.b64encode(buffer.getvalue()).decode()
+    
+    def payload(i):
+        return build_qr_payload(str(uuid.UUID(int=i)), utcnow())
+    
+    def measure(name, render, payloads):
+        timings = []
+        for item in payloads:
+            started = time.perf_counter()
+            render(item)
+            timings.append((time.perf_counter() - started) * 1000)
+        percentiles = statistics.quantiles(timings, n=100)
+        print(f"{name:<14} p50={percentiles[49]:8.3f} ms  p99={percentiles[98]:8.3f} ms")
+    
+    unique = [payload(i) for i in range(iterations)]
+    repeated = [payload(0)] * iterations
+    
+    render_qr_png.cache_clear()
+    measure('legacy', legacy_render, unique)
+    measure('png (cold)', render_qr_png, unique)
+    measure('png (cached)', render_qr_png, repeated)
+    measure('svg (cold)', render_qr_svg, unique)
 
 # Helper function
 def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
+def parse_page_size(value):
+    if not value:
+        return app.config['RECORDS_PAGE_SIZE']
+    size = int(value)
+    if size < 1:
+        raise ValueError('Page size must be positive')
+    return min(size, app.config['RECORDS_MAX_PAGE_SIZE'])
+
+# Timestamps are stored in UTC; SQLite hands them back without tzinfo
+def as_utc(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def parse_date(value):
+    return as_utc(datetime.strptime(value, '%Y-%m-%d'))
+
+# Keyset cursors are opaque "<timestamp>|<id>" strings of the last row on a page
+def encode_cursor(timestamp, row_id):
+    raw = f'{timestamp.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    timestamp, row_id = raw.split('|', 1)
+    return as_utc(datetime.fromisoformat(timestamp)), row_id
+
+# Access tokens: login returns a signed, expiring token carrying the user's type, id and
+# name. Requests send it as "Authorization: Bearer <token>" and it is never read from the
+# URL. Verified tokens are cached until they expire, so authenticated requests cost
+# neither a signature check nor a user lookup.
+access_token_serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='attendease-access')
+
+def issue_access_token(user_type, user):
+    return access_token_serializer.dumps({'t': user_type, 'u': user.id, 'n': user.fullname})
+
+class AccessTokenCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+    
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._entries[token]
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(token)
+            self._stats['hits'] += 1
+            return entry[1]
+    
+    def put(self, token, identity, expires_at):
+        with self._lock:
+            self._entries[token] = (expires_at, identity)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+    
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        return stats
+
+access_tokens = AccessTokenCache(app.config['ACCESS_TOKEN_CACHE_SIZE'])
+
+def read_access_token(token):
+    identity = access_tokens.get(token)
+    if identity is not None:
+        return identity
+    
+    max_age = app.config['ACCESS_TOKEN_MAX_AGE']
+    try:
+        data, signed_at = access_token_serializer.loads(token, max_age=max_age, return_timestamp=True)
+        identity = {'type': data['t'], 'id': data['u'], 'name': data['n']}
+    except (BadSignature, KeyError, TypeError):
+        return None
+    access_tokens.put(token, identity, signed_at.timestamp() + max_age)
+    return identity
+
+@app.before_request
+def load_current_user():
+    g.user = None
+    authorization = request.headers.get('Authorization', '')
+    if authorization.startswith('Bearer '):
+        g.user = read_access_token(authorization[len('Bearer '):].strip())
+
+# View tokens: <img> and EventSource cannot send headers, so the QR image, live QR and
+# event stream routes also take ?token=, a token that only opens one session's views for
+# its teacher and expires after SESSION_VIEW_TOKEN_MAX_AGE. URLs (and the logs that keep
+# them) never carry the login token.
+view_token_serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='attendease-session-view')
+
+def issue_view_token(session_id, teacher_id):
+    return view_token_serializer.dumps([session_id, teacher_id])
+
+def view_token_accepted(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = request.args.get('token')
+        if token and g.user is None:
+            try:
+                session_id, teacher_id = view_token_serializer.loads(
+                    token, max_age=app.config['SESSION_VIEW_TOKEN_MAX_AGE']
+                )
+            except (BadSignature, TypeError, ValueError):
+                return jsonify({'error': 'This link has expired, please reload'}), 401
+            if session_id != kwargs.get('session_id'):
+                return jsonify({'error': 'Not allowed for this session'}), 403
+            g.user = {'type': 'teacher', 'id': teacher_id, 'name': None}
+        return view(*args, **kwargs)
+    return wrapper
+
+def login_required(user_type):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if g.user is None:
+                return jsonify({'error': 'Please log in again'}), 401
+            if g.user['type'] != user_type:
+                return jsonify({'error': 'Not allowed for this account'}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Idempotency-Key support: the first request with a key runs the view and stores its
+# response; retries with the same key (and body) get that response back without running
+# the view again, and retries that arrive while it is still running wait for it.
+class IdempotencyStore:
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'replays': 0, 'stored': 0, 'evictions': 0}
+    
+    def claim(self, key, fingerprint):
+        # Returns (entry, True) if the caller should run the request, (entry, False) for a retry
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires_at'] < now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats['replays'] += 1
+                return entry, False
+            entry = {'fingerprint': fingerprint, 'done': threading.Event(), 'response': None, 'expires_at': now + self.ttl}
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+            return entry, True
+    
+    def complete(self, key, entry, response):
+        # response is (body, status), or None to forget the key so the client can retry
+        with self._lock:
+            if response is None:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            else:
+                entry['response'] = response
+                self._stats['stored'] += 1
+        entry['done'].set()
+    
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        return stats
+
+idempotency_store = IdempotencyStore(
+    app.config['IDEMPOTENCY_TTL'],
+    app.config['IDEMPOTENCY_CACHE_SIZE']
+)
+
+def idempotent(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'error': 'Idempotency-Key is too long'}), 400
+        
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        user = g.get('user')
+        caller = f"{user['type']}:{user['id']}" if user else ''
+        store_key = f'{request.path}|{caller}|{key}'
+        entry, is_first = idempotency_store.claim(store_key, fingerprint)
+        
+        if not is_first:
+            if entry['fingerprint'] != fingerprint:
+                return jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422
+            if not entry['done'].wait(app.config['IDEMPOTENCY_WAIT_SECONDS']) or entry['response'] is None:
+                return jsonify({'error': 'The original request is still in progress or failed, please retry'}), 409
+            body, status = entry['response']
+            response = app.response_class(body, status=status, mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_store.complete(store_key, entry, None)
+            raise
+        # Server errors are not stored, so a retry runs the request again
+        if response.status_code >= 500:
+            idempotency_store.complete(store_key, entry, None)
+        else:
+            idempotency_store.complete(store_key, entry, (response.get_data(), response.status_code))
+        return response
+    return wrapper
+
+# Student import: rows are streamed from CSV or JSON lines, checked in batches against the
+# unique email / roll_no indexes, hashed in the password pool and inserted one transaction
+# per batch. import_students yields a progress report after every batch.
+STUDENT_IMPORT_FIELDS = ['fullname', 'email', 'password', 'roll_no', 'course', 'year', 'section']
+
+def iter_import_rows(lines, file_format):
+    # Yields (row number, dict or None); lines is an iterable of text lines
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_no, row if isinstance(row, dict) else None
+
+def import_student_batch(batch, seen_emails, seen_roll_nos):
+    errors = []
+    candidates = []
+    for line_no, row in batch:
+        if row is None:
+            errors.append({'row': line_no, 'error': 'Unreadable row'})
+            continue
+        row = {field: str(row.get(field) or '').strip() for field in STUDENT_IMPORT_FIELDS}
+        row['email'] = row['email'].lower()
+        missing = [field for field in STUDENT_IMPORT_FIELDS if not row[field]]
+        if missing:
+            errors.append({'row': line_no, 'error': f"{missing[0]} is required"})
+        elif not validate_email(row['email']):
+            errors.append({'row': line_no, 'error': 'Invalid email format'})
+        elif row['email'] in seen_emails:
+            errors.append({'row': line_no, 'error': 'Email appears twice in the import'})
+        elif row['roll_no'] in seen_roll_nos:
+            errors.append({'row': line_no, 'error': 'Roll number appears twice in the import'})
+        else:
+            seen_emails.add(row['email'])
+            seen_roll_nos.add(row['roll_no'])
+            candidates.append((line_no, row))
+    
+    # One query against the unique indexes for the whole batch
+    existing_emails = set()
+    existing_roll_nos = set()
+    if candidates:
+        for email, roll_no in db.session.query(Student.email, Student.roll_no).filter(or_(
+            Student.email.in_([row['email'] for _, row in candidates]),
+            Student.roll_no.in_([row['roll_no'] for _, row in candidates])
+        )):
+            existing_emails.add(email)
+            existing_roll_nos.add(roll_no)
+    
+    accepted = []
+    for line_no, row in candidates:
+        if row['email'] in existing_emails:
+            errors.append({'row': line_no, 'error': 'Email already registered'})
+        elif row['roll_no'] in existing_roll_nos:
+            errors.append({'row': line_no, 'error': 'Roll number already exists'})
+        else:
+            accepted.append((line_no, row))
+    
+    if accepted:
+        hashes = password_hasher.hash_many([row.pop('password') for _, row in accepted])
+        for (_, row), password_hash in zip(accepted, hashes):
+            row['password_hash'] = password_hash
+        try:
+            db.session.execute(db.insert(Student), [row for _, row in accepted])
+            db.session.commit()
+        except IntegrityError:
+            # Someone registered one of these students after the uniqueness check
+            db.session.rollback()
+            errors.extend({'row': line_no, 'error': 'Conflicted with a concurrent registration, import it again'} for line_no, _ in accepted)
+            accepted = []
+        
+        if accepted:
+            for student_id, section in db.session.query(Student.id, Student.section).filter(
+                Student.email.in_([row['email'] for _, row in accepted])
+            ):
+                roster_index.add_student(student_id, section)
+    
+    errors.sort(key=lambda error: error['row'])
+    return len(accepted), errors
+
+def import_students(rows, batch_size):
+    seen_emails = set()
+    seen_roll_nos = set()
+    processed = imported = 0
+    batch = []
+    
+    def report(errors):
+        return {'processed': processed, 'imported': imported, 'errors': errors}
+    
+    for line in rows:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            count, errors = import_student_batch(batch, seen_emails, seen_roll_nos)
+            processed += len(batch)
+            imported += count
+            batch = []
+            yield report(errors)
+    if batch:
+        count, errors = import_student_batch(batch, seen_emails, seen_roll_nos)
+        processed += len(batch)
+        imported += count
+        yield report(errors)
+
+def import_format(name):
+    return 'csv' if name.lower().endswith('csv') else 'jsonl'
+
+@app.cli.command('import-students')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension')
+@click.option('--batch-size', default=None, type=int, help='Rows per transaction')
+def import_students_command(path, file_format, batch_size):
+    file_format = file_format or import_format(path)
+    batch_size = batch_size or app.config['STUDENT_IMPORT_BATCH_SIZE']
+    started = time.perf_counter()
+    imported = error_count = 0
+    with open(path, newline='', encoding='utf-8-sig') as source:
+        for progress in import_students(iter_import_rows(source, file_format), batch_size):
+            for error in progress['errors']:
+                print(f"❌ Row {error['row']}: {error['error']}")
+            imported = progress['imported']
+            error_count += len(progress['errors'])
+            print(f"📥 {progress['processed']} rows read, {imported} imported")
+    print(f"✅ Imported {imported} students with {error_count} errors in {time.perf_counter() - started:.1f}s")
+
 # Routes
 @app.route('/')
 def home():
     return jsonify({'message': 'AttendEase API is running!', 'status': 'success'})
 
 @app.route('/api/register/teacher', methods=['POST'])
+@idempotent
 def register_teacher():
     try:
         data = request.get_json()
@@ -118,11 +1621,15 @@ def register_teacher():
         
         return jsonify({'message': 'Teacher registered successfully'}), 201
         
+    except PasswordHasherBusy:
+        db.session.rollback()
+        return jsonify({'error': 'Server busy, please try again'}), 503
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Registration failed'}), 500
 
 @app.route('/api/register/student', methods=['POST'])
+@idempotent
 def register_student():
     try:
         data = request.get_json()
@@ -156,9 +1663,13 @@ def register_student():
         
         db.session.add(student)
         db.session.commit()
+        roster_index.add_student(student.id, student.section)
         
         return jsonify({'message': 'Student registered successfully'}), 201
         
+    except PasswordHasherBusy:
+        db.session.rollback()
+        return jsonify({'error': 'Server busy, please try again'}), 503
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Registration failed'}), 500
@@ -184,8 +1695,20 @@ def login():
         if not user or not user.check_password(password):
             return jsonify({'error': 'Invalid credentials'}), 401
         
+        # Upgrade hashes made under an older PASSWORD_HASH_METHOD while we have the password
+        if password_hasher.needs_rehash(user.password_hash):
+            try:
+                user.set_password(password)
+                db.session.commit()
+                password_hasher.note_rehash()
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️ Password rehash for {user_type} {user.id} failed: {e}")
+        
         return jsonify({
             'message': 'Login successful',
+            'access_token': issue_access_token(user_type, user),
+            'expires_in': app.config['ACCESS_TOKEN_MAX_AGE'],
             'user': {
                 'id': user.id,
                 'fullname': user.fullname,
@@ -194,15 +1717,48 @@ def login():
             }
         }), 200
         
+    except PasswordHasherBusy:
+        return jsonify({'error': 'Server busy, please try again'}), 503
     except Exception as e:
         return jsonify({'error': 'Login failed'}), 500
 
+@app.route('/api/teacher/students/import', methods=['POST'])
+@login_required('teacher')
+def import_students_upload():
+    # Body is the raw file; the response streams one JSON progress line per batch
+    mimetype = request.mimetype or ''
+    file_format = request.args.get('format') or ('csv' if 'csv' in mimetype else 'jsonl')
+    if file_format not in ('csv', 'jsonl'):
+        return jsonify({'error': 'Format must be csv or jsonl'}), 400
+    try:
+        batch_size = min(int(request.args.get('batch_size', app.config['STUDENT_IMPORT_BATCH_SIZE'])), 5000)
+    except ValueError:
+        return jsonify({'error': 'Invalid batch_size'}), 400
+    
+    def generate():
+        lines = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+        progress = {'processed': 0, 'imported': 0, 'errors': []}
+        try:
+            for progress in import_students(iter_import_rows(lines, file_format), max(batch_size, 1)):
+                yield json.dumps(progress) + '\n'
+        except PasswordHasherBusy:
+            db.session.rollback()
+            yield json.dumps({'error': 'Server busy, import the remaining rows again'}) + '\n'
+            return
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Student import failed: {e}")
+            yield json.dumps({'error': 'Import failed'}) + '\n'
+            return
+        yield json.dumps({'done': True, 'processed': progress['processed'], 'imported': progress['imported']}) + '\n'
+    
+    return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/api/teacher/subjects', methods=['GET'])
+@login_required('teacher')
 def get_subjects():
     try:
-        teacher_id = request.args.get('teacher_id')
-        if not teacher_id:
-            return jsonify({'error': 'Teacher ID required'}), 400
+        teacher_id = g.user['id']
         
         subjects = Subject.query.filter_by(teacher_id=teacher_id).all()
         result = [{'id': s.id, 'name': s.name} for s in subjects]
@@ -213,15 +1769,16 @@ def get_subjects():
         return jsonify({'error': 'Failed to fetch subjects'}), 500
 
 @app.route('/api/teacher/subjects', methods=['POST'])
+@login_required('teacher')
 def add_subject():
     try:
         data = request.get_json()
         
-        teacher_id = data.get('teacher_id')
+        teacher_id = g.user['id']
         name = data.get('name', '').strip()
         
-        if not teacher_id or not name:
-            return jsonify({'error': 'Teacher ID and subject name required'}), 400
+        if not name:
+            return jsonify({'error': 'Subject name required'}), 400
         
         # Check if subject exists
         existing = Subject.query.filter_by(teacher_id=teacher_id, name=name).first()
@@ -238,14 +1795,30 @@ def add_subject():
         db.session.rollback()
         return jsonify({'error': 'Failed to add subject'}), 500
 
+# Serialises find-or-create so a double click cannot open two sessions in this process
+session_create_lock = threading.Lock()
+
+def find_reusable_session(teacher_id, subject_id, class_section, qr_mode):
+    now = utcnow()
+    window = min(timedelta(minutes=app.config['SESSION_REUSE_WINDOW_MINUTES']), session_lifetime())
+    return AttendanceSession.query.filter(
+        AttendanceSession.teacher_id == teacher_id,
+        AttendanceSession.subject_id == subject_id,
+        AttendanceSession.class_section == class_section,
+        AttendanceSession.qr_mode == qr_mode,
+        AttendanceSession.is_active == True,
+        AttendanceSession.created_at >= now - window
+    ).order_by(AttendanceSession.created_at.desc()).first()
+
 @app.route('/api/teacher/generate-qr', methods=['POST'])
+@login_required('teacher')
 def generate_qr_code():
     try:
         print("🔄 QR Code generation started...")
         data = request.get_json()
         print(f"📥 Received data: {data}")
         
-        teacher_id = data.get('teacher_id')
+        teacher_id = g.user['id']
         subject_id = data.get('subject_id')
         class_section = data.get('class_section', '').strip()
         
@@ -253,93 +1826,69 @@ def generate_qr_code():
         print(f"📚 Subject ID: {subject_id}")
         print(f"🏫 Class Section: {class_section}")
         
-        if not all([teacher_id, subject_id, class_section]):
+        if not all([subject_id, class_section]):
             print("❌ Missing required fields")
             return jsonify({'error': 'All fields required'}), 400
         
-        # Verify teacher and subject
-        teacher = Teacher.query.get(teacher_id)
+        # Verify subject; the teacher comes from the access token
         subject = Subject.query.filter_by(id=subject_id, teacher_id=teacher_id).first()
         
-        if not teacher:
-            print("❌ Teacher not found")
-            return jsonify({'error': 'Teacher not found'}), 404
-            
         if not subject:
             print("❌ Subject not found")
             return jsonify({'error': 'Subject not found'}), 404
         
-        print(f"✅ Teacher: {teacher.fullname}")
+        print(f"✅ Teacher: {g.user['name']}")
         print(f"✅ Subject: {subject.name}")
         
-        # Create session
-        session_id = str(uuid.uuid4())
-        session = AttendanceSession(
-            id=session_id,
-            teacher_id=teacher_id,
-            subject_id=subject_id,
-            class_section=class_section
-        )
+        # Projector mode is fixed per session: rotating sessions never hand out a static QR
+        qr_mode = 'rotating' if data.get('rotating') else 'static'
         
-        db.session.add(session)
-        db.session.commit()
-        print(f"✅ Session created: {session_id}")
+        # Reuse the open session for this class unless the teacher asks for a new one
+        force_new = bool(data.get('force_new'))
+        with session_create_lock:
+            session = None if force_new else find_reusable_session(teacher_id, subject_id, class_section, qr_mode)
+            reused = session is not None
+            
+            if session is None:
+                session = AttendanceSession(
+                    id=str(uuid.uuid4()),
+                    teacher_id=teacher_id,
+                    subject_id=subject_id,
+                    class_section=class_section,
+                    qr_mode=qr_mode
+                )
+                db.session.add(session)
+                db.session.commit()
+                print(f"✅ Session created: {session.id}")
+            else:
+                print(f"♻️ Reusing session: {session.id}")
+        
+        session_id = session.id
+        active_sessions.put(session_id, session_info_for(session))
+        live_attendance.open(session_id, class_section, session.created_at)
         
-        # Generate QR data
-        qr_data = {
+        # The image itself is served (and cached) by session_qr_image, or session_live_qr in projector mode
+        rotating = qr_mode == 'rotating'
+        response_data = {
             'session_id': session_id,
-            'subject': subject.name,
-            'teacher': teacher.fullname,
-            'class_section': class_section
+            'qr_mode': qr_mode,
+            'qr_url': None if rotating else url_for('session_qr_image', session_id=session_id, image_format='png'),
+            'qr_svg_url': None if rotating else url_for('session_qr_image', session_id=session_id, image_format='svg'),
+            'qr_live_url': url_for('session_live_qr', session_id=session_id) if rotating else None,
+            'rotation_seconds': app.config['QR_ROTATION_SECONDS'],
+            'view_token': issue_view_token(session_id, teacher_id),
+            'view_token_expires_in': app.config['SESSION_VIEW_TOKEN_MAX_AGE'],
+            'expires_at': (as_utc(session.created_at) + session_lifetime()).isoformat(),
+            'reused': reused,
+            'session_info': {
+                'subject': subject.name,
+                'class_section': class_section,
+                'teacher': g.user['name']
+            }
         }
-        print(f"📋 QR Data: {qr_data}")
         
-        try:
-            # Create QR code with detailed error handling
-            print("🔧 Creating QR Code object...")
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            
-            print("📝 Adding data to QR Code...")
-            qr_data_string = json.dumps(qr_data)
-            qr.add_data(qr_data_string)
-            qr.make(fit=True)
-            
-            print("🖼️ Creating QR Code image...")
-            img = qr.make_image(fill_color="black", back_color="white")
-            print("✅ QR image created successfully")
-            
-            # Convert to base64
-            print("🔄 Converting to base64...")
-            buffer = io.BytesIO()
-            img.save(buffer, format='PNG')
-            buffer.seek(0)
-            img_str = base64.b64encode(buffer.getvalue()).decode()
-            print("✅ QR code converted to base64")
-            
-            response_data = {
-                'session_id': session_id,
-                'qr_code': f'data:image/png;base64,{img_str}',
-                'session_info': {
-                    'subject': subject.name,
-                    'class_section': class_section,
-                    'teacher': teacher.fullname
-                }
-            }
-            
-            print("🎉 QR Code generation completed successfully!")
-            return jsonify(response_data), 200
-            
-        except Exception as qr_error:
-            print(f"❌ QR Code creation error: {qr_error}")
-            print(f"❌ Error type: {type(qr_error)}")
-            import traceback
-            print(f"❌ Full traceback: {traceback.format_exc()}")
-            return jsonify({'error': f'QR Code generation failed: {str(qr_error)}'}), 500
+        print("🎉 QR Code session ready!")
+        return jsonify(response_data), 200
         
     except Exception as e:
         print(f"❌ General error: {e}")
@@ -349,41 +1898,254 @@ def generate_qr_code():
         db.session.rollback()
         return jsonify({'error': f'Failed to generate QR code: {str(e)}'}), 500
 
+@app.route('/api/sessions/<session_id>/view-token', methods=['POST'])
+@login_required('teacher')
+def session_view_token(session_id):
+    # Fresh view token for an open session's QR image, live QR and event stream
+    session_info = get_active_session(session_id)
+    if not session_info or str(session_info['teacher_id']) != str(g.user['id']):
+        return jsonify({'error': 'Session not found or expired'}), 404
+    return jsonify({
+        'view_token': issue_view_token(session_id, g.user['id']),
+        'expires_in': app.config['SESSION_VIEW_TOKEN_MAX_AGE']
+    }), 200
+
+@app.route('/api/sessions/<session_id>/qr.<any(png, svg):image_format>', methods=['GET'])
+@view_token_accepted
+@login_required('teacher')
+def session_qr_image(session_id, image_format):
+    try:
+        uuid.UUID(session_id)
+    except ValueError:
+        return jsonify({'error': 'Session not found'}), 404
+    
+    # Only the session's teacher gets the image; rotating sessions only show live frames,
+    # since a static token would outlive every frame
+    session = AttendanceSession.query.filter_by(id=session_id).first()
+    if not session or str(session.teacher_id) != str(g.user['id']) or session.qr_mode == 'rotating':
+        return jsonify({'error': 'Session not found'}), 404
+    
+    payload = session_qr_payload(session)
+    render, mimetype = QR_RENDERERS[image_format]
+    etag = hashlib.sha256(f'{image_format}:{payload}'.encode()).hexdigest()[:32]
+    
+    # Answer revalidations before rendering anything
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(render(payload), mimetype=mimetype)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = app.config['QR_IMAGE_MAX_AGE']
+    response.vary.add('Authorization')
+    return response
+
+@app.route('/api/sessions/<session_id>/qr/live.png', methods=['GET'])
+@view_token_accepted
+@login_required('teacher')
+def session_live_qr(session_id):
+    # Only the session's teacher may pull frames, or rotation would not stop remote scans
+    session_info = get_active_session(session_id)
+    if not session_info or str(session_info['teacher_id']) != str(g.user['id']) or session_info['qr_mode'] != 'rotating':
+        return jsonify({'error': 'Session not found or expired'}), 404
+    
+    session_expires_at = as_utc(session_info['created_at']) + session_lifetime()
+    png, refresh_in = rotating_qr.current_frame(session_id, session_expires_at)
+    response = app.response_class(png, mimetype='image/png')
+    response.cache_control.no_store = True
+    response.headers['X-QR-Refresh-In'] = f'{refresh_in:.2f}'
+    return response
+
+@app.route('/api/sessions/<session_id>/status', methods=['GET'])
+@login_required('teacher')
+def session_status(session_id):
+    try:
+        teacher_id = g.user['id']
+        
+        # Open sessions use the section roster; closed ones the roster persisted at close
+        session = None
+        session_info = get_active_session(session_id)
+        if session_info is not None:
+            if str(session_info['teacher_id']) != str(teacher_id):
+                return jsonify({'error': 'Session not found'}), 404
+            roster = roster_index.roster(session_info['class_section'])
+            is_active = True
+        else:
+            try:
+                uuid.UUID(session_id)
+            except ValueError:
+                return jsonify({'error': 'Session not found'}), 404
+            session = db.session.get(AttendanceSession, session_id)
+            if not session or str(session.teacher_id) != str(teacher_id):
+                return jsonify({'error': 'Session not found'}), 404
+            
+            session_info = session_info_for(session)
+            is_active = False
+            if session.roster_ids is not None:
+                roster = unpack_student_ids(session.roster_ids)
+            else:
+                roster = roster_index.roster(session.class_section)
+        
+        if session is not None and session.present_bitmap is not None:
+            # Closed sessions answer from the bitset persisted at close, without touching attendance
+            bitmap = session.present_bitmap
+            absent_ids = [
+                student_id for position, student_id in enumerate(roster)
+                if not bitmap[position >> 3] >> (position & 7) & 1
+            ]
+            outside_count = len(unpack_student_ids(session.present_outside_ids))
+        else:
+            # Who is present comes from the attendance table (an index-only scan of
+            # ux_attendance_session_student), so every worker gives the same answer
+            present = {
+                student_id for (student_id,) in db.session.query(Attendance.student_id).filter(
+                    Attendance.session_id == session_id
+                )
+            }
+            absent_ids = [student_id for student_id in roster if student_id not in present]
+            outside_count = len(present) - (len(roster) - len(absent_ids))
+        
+        # Absentees are named in one primary-key IN query
+        absent = []
+        if absent_ids:
+            students = db.session.query(Student.id, Student.fullname, Student.roll_no).filter(
+                Student.id.in_(absent_ids)
+            ).order_by(Student.roll_no)
+            absent = [{'id': s.id, 'name': s.fullname, 'roll_no': s.roll_no} for s in students]
+        
+        return jsonify({
+            'session_id': session_id,
+            'class_section': session_info['class_section'],
+            'is_active': is_active,
+            'present_count': len(roster) - len(absent_ids),
+            'present_outside_roster': outside_count,
+            'roster_size': len(roster),
+            'absent_count': len(absent_ids),
+            'absent': absent
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to fetch session status'}), 500
+
+@app.route('/api/sessions/<session_id>/events', methods=['GET'])
+@view_token_accepted
+@login_required('teacher')
+def session_events(session_id):
+    teacher_id = g.user['id']
+    
+    session_info = get_active_session(session_id)
+    if not session_info or str(session_info['teacher_id']) != str(teacher_id):
+        return jsonify({'error': 'Session not found or expired'}), 404
+    
+    live_attendance.open(session_id, session_info['class_section'], session_info['created_at'])
+    events = live_scan_hub.subscribe(session_id)
+    if events is None:
+        return jsonify({'error': 'Too many live viewers, please retry shortly'}), 503
+    
+    heartbeat = app.config['SSE_HEARTBEAT_SECONDS']
+    max_stream_seconds = app.config['SSE_MAX_STREAM_SECONDS']
+    retry_ms = app.config['SSE_RETRY_MS']
+    count = live_attendance.present_count(session_id)
+    
+    # Streams end after SSE_MAX_STREAM_SECONDS and the browser reconnects on its own
+    def stream():
+        try:
+            yield f'retry: {retry_ms}\n'
+            yield f"event: status\ndata: {json.dumps({'count': count})}\n\n"
+            deadline = time.monotonic() + max_stream_seconds
+            while time.monotonic() < deadline:
+                try:
+                    scan = events.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f'event: scan\ndata: {json.dumps(scan)}\n\n'
+        finally:
+            live_scan_hub.unsubscribe(session_id, events)
+    
+    response = app.response_class(stream(), mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/student/mark-attendance', methods=['POST'])
+@login_required('student')
+@idempotent
 def mark_attendance():
     try:
         data = request.get_json()
         
         qr_data_str = data.get('qr_data')
-        student_id = data.get('student_id')
+        student_id = g.user['id']
         
-        if not qr_data_str or not student_id:
-            return jsonify({'error': 'QR data and student ID required'}), 400
+        if not qr_data_str:
+            return jsonify({'error': 'QR data required'}), 400
         
-        # Parse QR data
-        try:
-            qr_data = json.loads(qr_data_str)
-            session_id = qr_data.get('session_id')
-        except:
-            return jsonify({'error': 'Invalid QR code'}), 400
+        # Signed token: validity and expiry are checked without touching the database
+        if not qr_data_str.lstrip().startswith('{'):
+            try:
+                session_id, is_frame = read_qr_payload(qr_data_str)
+            except SignatureExpired:
+                return jsonify({'error': 'Session not found or expired'}), 400
+            except (BadSignature, KeyError, TypeError):
+                return jsonify({'error': 'Invalid QR code'}), 400
+            
+            # A static token is only good for a static session (cached lookup)
+            if not is_frame:
+                session_info = get_active_session(session_id)
+                if not session_info:
+                    return jsonify({'error': 'Session not found or expired'}), 400
+                if session_info['qr_mode'] == 'rotating':
+                    return jsonify({'error': 'Please scan the QR code shown in class'}), 400
         
-        if not session_id:
-            return jsonify({'error': 'Invalid QR code data'}), 400
+        # Legacy JSON QR codes printed before signed tokens: only inside the transition window,
+        # checked before any parsing or lookup, and only for sessions that predate signed codes
+        else:
+            if not legacy_qr_accepted():
+                return jsonify({'error': 'This QR code is no longer supported, please scan a new one'}), 400
+            
+            try:
+                qr_data = json.loads(qr_data_str)
+                session_id = qr_data.get('session_id')
+            except:
+                return jsonify({'error': 'Invalid QR code'}), 400
+            
+            if not session_id:
+                return jsonify({'error': 'Invalid QR code data'}), 400
+            
+            # Verify session (cached for repeated scans of the same QR)
+            session_info = get_active_session(session_id)
+            if not session_info:
+                return jsonify({'error': 'Session not found or expired'}), 400
+            if session_info['qr_mode'] is not None:
+                return jsonify({'error': 'Please scan the QR code shown in class'}), 400
         
-        # Verify session
-        session = AttendanceSession.query.filter_by(id=session_id, is_active=True).first()
-        if not session:
-            return jsonify({'error': 'Session not found or expired'}), 400
+        # Write-behind mode: reject known duplicates now, let the flusher insert the row
+        if app.config['ATTENDANCE_WRITE_BEHIND']:
+            if Attendance.query.filter_by(session_id=session_id, student_id=student_id).first():
+                return jsonify({'error': 'Attendance already marked'}), 400
+            try:
+                if not attendance_writer.submit(session_id, student_id):
+                    return jsonify({'error': 'Attendance already marked'}), 400
+            except queue.Full:
+                return jsonify({'error': 'Server busy, please scan again'}), 503
+            return jsonify({'message': 'Attendance marked successfully'}), 202
         
-        # Check if already marked
-        existing = Attendance.query.filter_by(session_id=session_id, student_id=student_id).first()
-        if existing:
+        # Mark attendance in one statement; the unique (session_id, student_id) index skips duplicates
+        marked_at = utcnow()
+        result = db.session.execute(
+            insert_ignoring_duplicates(Attendance, ['session_id', 'student_id']).values(
+                session_id=session_id,
+                student_id=student_id,
+                marked_at=marked_at
+            )
+        )
+        db.session.commit()
+        
+        if result.rowcount == 0:
             return jsonify({'error': 'Attendance already marked'}), 400
         
-        # Mark attendance
-        attendance = Attendance(session_id=session_id, student_id=student_id)
-        db.session.add(attendance)
-        db.session.commit()
+        publish_scans(session_id, [(student_id, marked_at)])
         
         return jsonify({'message': 'Attendance marked successfully'}), 200
         
@@ -391,73 +2153,371 @@ def mark_attendance():
         db.session.rollback()
         return jsonify({'error': 'Failed to mark attendance'}), 500
 
+@app.route('/api/student/sync-scans', methods=['POST'])
+@login_required('student')
+def sync_offline_scans():
+    try:
+        data = request.get_json()
+        
+        student_id = g.user['id']
+        scans = data.get('scans')
+        
+        if not isinstance(scans, list):
+            return jsonify({'error': 'Scans required'}), 400
+        if len(scans) > app.config['OFFLINE_SYNC_MAX_SCANS']:
+            return jsonify({'error': f"At most {app.config['OFFLINE_SYNC_MAX_SCANS']} scans per sync"}), 400
+        
+        # scanned_at comes from the client, so it only places the scan inside its session.
+        # Freshness rests on server time: a token must have still been valid no more than
+        # OFFLINE_CLOCK_SKEW_SECONDS + OFFLINE_SYNC_ALLOWANCE_SECONDS before this request.
+        # Rotating frames therefore have to sync within that allowance.
+        now = utcnow()
+        skew = timedelta(seconds=app.config['OFFLINE_CLOCK_SKEW_SECONDS'])
+        valid_since = now - skew - timedelta(seconds=app.config['OFFLINE_SYNC_ALLOWANCE_SECONDS'])
+        results = []
+        pending = []
+        for scan in scans:
+            scan = scan if isinstance(scan, dict) else {}
+            result = {'id': scan.get('id')}
+            results.append(result)
+            try:
+                scanned_at = min(as_utc(datetime.fromisoformat(str(scan.get('scanned_at')).replace('Z', '+00:00'))), now)
+                qr_data_str = str(scan.get('qr_data') or '')
+                if qr_data_str.lstrip().startswith('{'):
+                    if not legacy_qr_accepted():
+                        raise BadSignature('Legacy QR code')
+                    session_id, kind = str(json.loads(qr_data_str)['session_id']), 'legacy'
+                    uuid.UUID(session_id)
+                else:
+                    session_id, is_frame = read_qr_payload(qr_data_str, now=max(scanned_at - skew, valid_since))
+                    kind = 'frame' if is_frame else 'static'
+            except SignatureExpired:
+                result['status'] = 'expired'
+                continue
+            except (BadSignature, KeyError, TypeError, ValueError):
+                result['status'] = 'invalid'
+                continue
+            pending.append((result, session_id, scanned_at, kind))
+        
+        # One query for the sessions involved, one for rows already marked
+        session_ids = {session_id for _, session_id, _, _ in pending}
+        sessions = {
+            session.id: session for session in db.session.query(
+                AttendanceSession.id, AttendanceSession.created_at, AttendanceSession.is_active, AttendanceSession.qr_mode
+            ).filter(AttendanceSession.id.in_(session_ids))
+        }
+        already_marked = {
+            row.session_id for row in db.session.query(Attendance.session_id).filter(
+                Attendance.student_id == student_id,
+                Attendance.session_id.in_(session_ids)
+            )
+        }
+        
+        rows = {}
+        for result, session_id, scanned_at, kind in pending:
+            session = sessions.get(session_id)
+            # Rotating sessions only accept their short-lived frames; legacy JSON only
+            # applies to sessions created before signed codes existed
+            if (session is None
+                    or (session.qr_mode == 'rotating' and kind != 'frame')
+                    or (kind == 'legacy' and session.qr_mode is not None)):
+                result['status'] = 'invalid'
+                continue
+            created_at = as_utc(session.created_at)
+            if not created_at - skew <= scanned_at <= created_at + session_lifetime() + skew:
+                result['status'] = 'expired'
+            elif not session.is_active or session_expired(created_at):
+                result['status'] = 'session_closed'
+            elif session_id in already_marked or session_id in rows:
+                result['status'] = 'already_marked'
+            else:
+                rows[session_id] = {
+                    'session_id': session_id,
+                    'student_id': student_id,
+                    'marked_at': max(scanned_at, created_at)
+                }
+                result['status'] = 'marked'
+        
+        if rows:
+            db.session.execute(
+                insert_ignoring_duplicates(Attendance, ['session_id', 'student_id']).values(list(rows.values()))
+            )
+        db.session.commit()
+        
+        for session_id, row in rows.items():
+            publish_scans(session_id, [(student_id, row['marked_at'])])
+        
+        return jsonify({'results': results, 'marked': len(rows)}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to sync scans'}), 500
+
+@app.route('/api/teacher/sessions/<session_id>/attendance', methods=['POST'])
+@login_required('teacher')
+def bulk_mark_attendance(session_id):
+    try:
+        data = request.get_json()
+        
+        teacher_id = g.user['id']
+        student_ids = data.get('student_ids') or []
+        roll_nos = data.get('roll_nos') or []
+        
+        if not isinstance(student_ids, list) or not isinstance(roll_nos, list):
+            return jsonify({'error': 'student_ids and roll_nos must be lists'}), 400
+        if not student_ids and not roll_nos:
+            return jsonify({'error': 'Provide student_ids or roll_nos'}), 400
+        if len(student_ids) + len(roll_nos) > app.config['BULK_ATTENDANCE_MAX_ITEMS']:
+            return jsonify({'error': f"At most {app.config['BULK_ATTENDANCE_MAX_ITEMS']} students per request"}), 400
+        
+        session_info = get_active_session(session_id)
+        if not session_info or str(session_info['teacher_id']) != str(teacher_id):
+            return jsonify({'error': 'Session not found or expired'}), 404
+        
+        ids = set()
+        for student_id in student_ids:
+            try:
+                ids.add(int(student_id))
+            except (TypeError, ValueError):
+                pass
+        rolls = {str(roll_no).strip() for roll_no in roll_nos}
+        
+        # Resolve ids and roll numbers in one query, then find rows already marked in another
+        students = db.session.query(Student.id, Student.roll_no).filter(
+            or_(Student.id.in_(ids), Student.roll_no.in_(rolls))
+        ).all()
+        by_id = {student.id for student in students}
+        by_roll = {student.roll_no: student.id for student in students}
+        already_marked = {
+            row.student_id for row in db.session.query(Attendance.student_id).filter(
+                Attendance.session_id == session_id,
+                Attendance.student_id.in_(by_id)
+            )
+        }
+        
+        results = []
+        to_insert = {}
+        def resolve(item, key, student_id):
+            if student_id is None:
+                results.append({key: item, 'status': 'not_found'})
+            elif student_id in already_marked or student_id in to_insert:
+                results.append({key: item, 'student_id': student_id, 'status': 'already_marked'})
+            else:
+                to_insert[student_id] = True
+                results.append({key: item, 'student_id': student_id, 'status': 'marked'})
+        
+        for item in student_ids:
+            try:
+                student_id = int(item)
+            except (TypeError, ValueError):
+                student_id = None
+            resolve(item, 'student_id', student_id if student_id in by_id else None)
+        for item in roll_nos:
+            resolve(item, 'roll_no', by_roll.get(str(item).strip()))
+        
+        # Multi-row INSERT in chunks that stay under the database's bound-parameter limit
+        marked_at = utcnow()
+        rows = [
+            {'session_id': session_id, 'student_id': student_id, 'marked_at': marked_at}
+            for student_id in to_insert
+        ]
+        chunk = app.config['BULK_INSERT_CHUNK_ROWS']
+        for start in range(0, len(rows), chunk):
+            db.session.execute(
+                insert_ignoring_duplicates(Attendance, ['session_id', 'student_id']).values(rows[start:start + chunk])
+            )
+        db.session.commit()
+        
+        if rows:
+            publish_scans(session_id, [(student_id, marked_at) for student_id in to_insert])
+        
+        return jsonify({
+            'results': results,
+            'marked': len(rows),
+            'already_marked': sum(1 for result in results if result['status'] == 'already_marked'),
+            'not_found': sum(1 for result in results if result['status'] == 'not_found')
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to mark attendance'}), 500
+
 @app.route('/api/teacher/attendance-records', methods=['GET'])
+@login_required('teacher')
 def get_attendance_records():
     try:
-        teacher_id = request.args.get('teacher_id')
-        if not teacher_id:
-            return jsonify({'error': 'Teacher ID required'}), 400
+        teacher_id = g.user['id']
+        
+        # Parse pagination and filters
+        try:
+            limit = parse_page_size(request.args.get('limit'))
+            cursor = request.args.get('cursor')
+            cursor = decode_cursor(cursor) if cursor else None
+            # Session ids are UUIDs; PostgreSQL rejects anything else in the keyset filter
+            if cursor:
+                cursor = (cursor[0], str(uuid.UUID(cursor[1])))
+            date_from = request.args.get('date_from')
+            date_from = parse_date(date_from) if date_from else None
+            date_to = request.args.get('date_to')
+            date_to = parse_date(date_to) if date_to else None
+            subject_id = request.args.get('subject_id')
+            subject_id = int(subject_id) if subject_id else None
+        except ValueError:
+            return jsonify({'error': 'Invalid pagination, subject or date parameters'}), 400
+        
+        class_section = request.args.get('class_section', '').strip()
         
-        sessions = AttendanceSession.query.filter_by(teacher_id=teacher_id).all()
+        # Pick one page of sessions, newest first, using the (created_at, id) keyset
+        page_query = db.session.query(
+            AttendanceSession.id, AttendanceSession.created_at
+        ).filter(AttendanceSession.teacher_id == teacher_id)
         
-        records = []
-        for session in sessions:
-            subject = Subject.query.get(session.subject_id)
-            attendance_count = Attendance.query.filter_by(session_id=session.id).count()
+        if subject_id:
+            page_query = page_query.filter(AttendanceSession.subject_id == subject_id)
+        if class_section:
+            page_query = page_query.filter(AttendanceSession.class_section == class_section)
+        if date_from:
+            page_query = page_query.filter(AttendanceSession.created_at >= date_from)
+        if date_to:
+            page_query = page_query.filter(AttendanceSession.created_at < date_to + timedelta(days=1))
+        if cursor:
+            cursor_created_at, cursor_id = cursor
+            page_query = page_query.filter(or_(
+                AttendanceSession.created_at < cursor_created_at,
+                and_(AttendanceSession.created_at == cursor_created_at, AttendanceSession.id < cursor_id)
+            ))
+        
+        page = page_query.order_by(
+            AttendanceSession.created_at.desc(), AttendanceSession.id.desc()
+        ).limit(limit + 1).all()
+        
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(page[-1].created_at, page[-1].id)
+        
+        if not page:
+            return jsonify({'records': [], 'next_cursor': None}), 200
+        
+        # One joined query for the page's sessions, subjects and present students
+        rows = db.session.query(
+            AttendanceSession.id,
+            AttendanceSession.class_section,
+            AttendanceSession.created_at,
+            Subject.name,
+            Attendance.id,
+            Attendance.marked_at,
+            Student.fullname,
+            Student.roll_no
+        ).outerjoin(
+            Subject, Subject.id == AttendanceSession.subject_id
+        ).outerjoin(
+            Attendance, Attendance.session_id == AttendanceSession.id
+        ).outerjoin(
+            Student, Student.id == Attendance.student_id
+        ).filter(
+            AttendanceSession.id.in_([session_id for session_id, _ in page])
+        ).order_by(
+            AttendanceSession.created_at.desc(), AttendanceSession.id.desc(), Attendance.id
+        ).all()
+        
+        # Group rows per session, counting attendance from the fetched rows
+        records_by_session = {}
+        for session_id, class_section, created_at, subject_name, attendance_id, marked_at, student_name, roll_no in rows:
+            record = records_by_session.get(session_id)
+            if record is None:
+                # PostgreSQL returns timestamps in the connection's time zone; report UTC everywhere
+                created_at = as_utc(created_at)
+                record = records_by_session[session_id] = {
+                    'session_id': session_id,
+                    'subject': subject_name or 'Unknown',
+                    'class_section': class_section,
+                    'date': created_at.strftime('%Y-%m-%d'),
+                    'time': created_at.strftime('%H:%M:%S'),
+                    'attendance_count': 0,
+                    'students': []
+                }
             
-            # Get student details
-            attendances = Attendance.query.filter_by(session_id=session.id).all()
-            students = []
-            for att in attendances:
-                student = Student.query.get(att.student_id)
-                if student:
-                    students.append({
-                        'name': student.fullname,
-                        'roll_no': student.roll_no,
-                        'marked_at': att.marked_at.strftime('%H:%M:%S')
-                    })
+            if attendance_id is None:
+                continue
             
-            records.append({
-                'session_id': session.id,
-                'subject': subject.name if subject else 'Unknown',
-                'class_section': session.class_section,
-                'date': session.created_at.strftime('%Y-%m-%d'),
-                'time': session.created_at.strftime('%H:%M:%S'),
-                'attendance_count': attendance_count,
-                'students': students
-            })
+            record['attendance_count'] += 1
+            if student_name is not None:
+                record['students'].append({
+                    'name': student_name,
+                    'roll_no': roll_no,
+                    'marked_at': as_utc(marked_at).strftime('%H:%M:%S')
+                })
         
-        return jsonify(records), 200
+        records = list(records_by_session.values())
+        
+        return jsonify({'records': records, 'next_cursor': next_cursor}), 200
         
     except Exception as e:
         return jsonify({'error': 'Failed to fetch records'}), 500
 
 @app.route('/api/student/attendance-history', methods=['GET'])
+@login_required('student')
 def get_student_history():
     try:
-        student_id = request.args.get('student_id')
-        if not student_id:
-            return jsonify({'error': 'Student ID required'}), 400
+        student_id = g.user['id']
+        
+        try:
+            limit = parse_page_size(request.args.get('limit'))
+            cursor = request.args.get('cursor')
+            cursor = decode_cursor(cursor) if cursor else None
+            # History rows have integer ids
+            if cursor:
+                cursor = (cursor[0], int(cursor[1]))
+            since = request.args.get('since')
+            since = as_utc(datetime.fromisoformat(since)) if since else None
+        except ValueError:
+            return jsonify({'error': 'Invalid pagination or since parameters'}), 400
+        
+        # Load attendance with its session, subject and teacher in one joined query
+        query = Attendance.query.join(
+            Attendance.session
+        ).outerjoin(
+            AttendanceSession.subject
+        ).outerjoin(
+            AttendanceSession.teacher
+        ).options(
+            contains_eager(Attendance.session).contains_eager(AttendanceSession.subject),
+            contains_eager(Attendance.session).contains_eager(AttendanceSession.teacher)
+        ).filter(Attendance.student_id == student_id)
+        
+        if since:
+            query = query.filter(Attendance.marked_at >= since)
+        if cursor:
+            cursor_marked_at, cursor_id = cursor
+            query = query.filter(or_(
+                Attendance.marked_at < cursor_marked_at,
+                and_(Attendance.marked_at == cursor_marked_at, Attendance.id < cursor_id)
+            ))
         
-        attendances = Attendance.query.filter_by(student_id=student_id).all()
+        attendances = query.order_by(
+            Attendance.marked_at.desc(), Attendance.id.desc()
+        ).limit(limit + 1).all()
+        
+        next_cursor = None
+        if len(attendances) > limit:
+            attendances = attendances[:limit]
+            next_cursor = encode_cursor(attendances[-1].marked_at, attendances[-1].id)
         
         history = []
         for att in attendances:
-            session = AttendanceSession.query.get(att.session_id)
-            if session:
-                subject = Subject.query.get(session.subject_id)
-                teacher = Teacher.query.get(session.teacher_id)
-                
-                history.append({
-                    'date': session.created_at.strftime('%Y-%m-%d'),
-                    'time': session.created_at.strftime('%H:%M:%S'),
-                    'subject': subject.name if subject else 'Unknown',
-                    'class_section': session.class_section,
-                    'teacher': teacher.fullname if teacher else 'Unknown',
-                    'marked_at': att.marked_at.strftime('%H:%M:%S')
-                })
+            session = att.session
+            created_at = as_utc(session.created_at)
+            history.append({
+                'date': created_at.strftime('%Y-%m-%d'),
+                'time': created_at.strftime('%H:%M:%S'),
+                'subject': session.subject.name if session.subject else 'Unknown',
+                'class_section': session.class_section,
+                'teacher': session.teacher.fullname if session.teacher else 'Unknown',
+                'marked_at': as_utc(att.marked_at).strftime('%H:%M:%S')
+            })
         
-        return jsonify(history), 200
+        return jsonify({'history': history, 'next_cursor': next_cursor}), 200
         
     except Exception as e:
         return jsonify({'error': 'Failed to fetch history'}), 500
@@ -466,9 +2526,21 @@ def get_student_history():
 def health():
     return jsonify({'status': 'healthy'})
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        'attendance_queue': attendance_writer.metrics(),
+        'active_session_cache': active_sessions.metrics(),
+        'live_attendance': live_attendance.metrics(),
+        'live_scan_hub': live_scan_hub.metrics(),
+        'idempotency': idempotency_store.metrics(),
+        'password_hasher': password_hasher.metrics(),
+        'access_tokens': access_tokens.metrics()
+    })
+
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        migrate_database()
         print("✅ Database created successfully!")
     
     print("🚀 Starting AttendEase API on http://127.0.0.1:5000")
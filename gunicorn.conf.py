@@ -0,0 +1,17 @@
+# Gunicorn settings for AttendEase: gunicorn app:app
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+# gevent workers park idle SSE streams on greenlets instead of OS threads
+worker_class = 'gevent'
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+
+# Each worker polls the attendance table for the sessions it streams, so a scan handled
+# by one worker reaches live feeds held open by any other
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+
+# SSE streams end on their own after SSE_MAX_STREAM_SECONDS
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = 30
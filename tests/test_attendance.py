@@ -0,0 +1,119 @@
+from datetime import timedelta
+
+def mark(client, headers, qr_data):
+    return client.post('/api/student/mark-attendance', json={'qr_data': qr_data}, headers=headers)
+
+def test_mark_attendance_once_per_session(client, classroom, open_session):
+    _, qr_data = open_session()
+    student = classroom['students'][0]
+
+    first = mark(client, student, qr_data)
+    assert first.status_code == 200, first.get_json()
+    second = mark(client, student, qr_data)
+    assert second.status_code == 400
+    assert second.get_json()['error'] == 'Attendance already marked'
+
+def test_mark_attendance_rejects_bad_qr(client, classroom, open_session):
+    open_session()
+    response = mark(client, classroom['students'][0], 'not-a-qr-code')
+    assert response.status_code == 400
+
+def test_session_status_open_and_closed(attendease, client, classroom, open_session):
+    session_id, qr_data = open_session()
+    mark(client, classroom['students'][0], qr_data)
+    mark(client, classroom['students'][1], qr_data)
+
+    status = client.get(f'/api/sessions/{session_id}/status', headers=classroom['teacher']).get_json()
+    assert status['is_active'] is True
+    assert (status['present_count'], status['absent_count'], status['roster_size']) == (2, 1, 3)
+    assert [student['roll_no'] for student in status['absent']] == ['R2']
+
+    # Closed sessions are answered from the persisted bitmap
+    with attendease.app.app_context():
+        attendease.expire_sessions(now=attendease.utcnow() + timedelta(days=1))
+    status = client.get(f'/api/sessions/{session_id}/status', headers=classroom['teacher']).get_json()
+    assert status['is_active'] is False
+    assert (status['present_count'], status['absent_count'], status['roster_size']) == (2, 1, 3)
+    assert [student['roll_no'] for student in status['absent']] == ['R2']
+
+def test_bulk_mark_attendance(client, classroom, open_session):
+    session_id, qr_data = open_session()
+    first, second, third = classroom['student_ids']
+    mark(client, classroom['students'][0], qr_data)
+
+    response = client.post(f'/api/teacher/sessions/{session_id}/attendance', json={
+        'student_ids': [first, second, 9999],
+        'roll_nos': ['R2', 'R1', 'missing']
+    }, headers=classroom['teacher'])
+    assert response.status_code == 200, response.get_json()
+    body = response.get_json()
+    assert (body['marked'], body['already_marked'], body['not_found']) == (2, 2, 2)
+    assert {result['student_id'] for result in body['results'] if result['status'] == 'marked'} == {second, third}
+
+    status = client.get(f'/api/sessions/{session_id}/status', headers=classroom['teacher']).get_json()
+    assert status['present_count'] == 3
+
+def test_sync_scans(attendease, client, classroom, open_session):
+    session_id, qr_data = open_session()
+    scanned_at = attendease.utcnow().isoformat()
+
+    response = client.post('/api/student/sync-scans', json={'scans': [
+        {'id': 'a', 'qr_data': qr_data, 'scanned_at': scanned_at},
+        {'id': 'b', 'qr_data': qr_data, 'scanned_at': scanned_at},
+        {'id': 'c', 'qr_data': 'garbage', 'scanned_at': scanned_at}
+    ]}, headers=classroom['students'][0])
+    assert response.status_code == 200, response.get_json()
+    body = response.get_json()
+    assert body['marked'] == 1
+    assert [result['status'] for result in body['results']] == ['marked', 'already_marked', 'invalid']
+
+    again = client.post('/api/student/sync-scans', json={'scans': [
+        {'id': 'a', 'qr_data': qr_data, 'scanned_at': scanned_at}
+    ]}, headers=classroom['students'][0]).get_json()
+    assert again['results'][0]['status'] == 'already_marked'
+
+def test_attendance_records_pagination(client, classroom, open_session):
+    session_ids = []
+    for _ in range(3):
+        session_id, qr_data = open_session()
+        mark(client, classroom['students'][0], qr_data)
+        session_ids.append(session_id)
+
+    records, cursor = [], None
+    while True:
+        query = '/api/teacher/attendance-records?limit=2' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(query, headers=classroom['teacher'])
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        assert len(body['records']) <= 2
+        records += body['records']
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+
+    assert sorted(record['session_id'] for record in records) == sorted(session_ids)
+    assert all(record['attendance_count'] == 1 for record in records)
+    assert records[0]['students'][0]['roll_no'] == 'R0'
+
+def test_attendance_records_rejects_bad_parameters(client, classroom):
+    for query in ('cursor=%25%25%25', 'subject_id=abc', 'date_from=yesterday', 'limit=-1'):
+        response = client.get(f'/api/teacher/attendance-records?{query}', headers=classroom['teacher'])
+        assert response.status_code == 400, query
+
+def test_student_history_pagination(client, classroom, open_session):
+    for _ in range(3):
+        _, qr_data = open_session()
+        mark(client, classroom['students'][0], qr_data)
+
+    first = client.get('/api/student/attendance-history?limit=2', headers=classroom['students'][0]).get_json()
+    assert len(first['history']) == 2
+    assert first['next_cursor']
+    second = client.get(
+        f"/api/student/attendance-history?limit=2&cursor={first['next_cursor']}", headers=classroom['students'][0]
+    ).get_json()
+    assert len(second['history']) == 1
+    assert second['next_cursor'] is None
+    assert second['history'][0]['subject'] == 'Math'
+
+    response = client.get('/api/student/attendance-history?cursor=nope', headers=classroom['students'][0])
+    assert response.status_code == 400
@@ -0,0 +1,31 @@
+from sqlalchemy import inspect, text
+
+def test_migrate_database_upgrades_an_old_schema(attendease, client, classroom, open_session):
+    session_id, _ = open_session()
+    student_id = classroom['student_ids'][0]
+    db = attendease.db
+
+    with attendease.app.app_context():
+        # Roll the schema back to before the unique scan index and the closed-session columns,
+        # with the duplicate scans such databases could hold
+        db.session.execute(text('DROP INDEX ux_attendance_session_student'))
+        db.session.execute(text('ALTER TABLE attendance_session DROP COLUMN present_outside_ids'))
+        db.session.execute(text('ALTER TABLE attendance_session DROP COLUMN present_bitmap'))
+        for _ in range(3):
+            db.session.execute(
+                text('INSERT INTO attendance (session_id, student_id, marked_at) VALUES (:session_id, :student_id, :marked_at)'),
+                {'session_id': session_id, 'student_id': student_id, 'marked_at': attendease.utcnow()}
+            )
+        db.session.commit()
+
+        attendease.migrate_database()
+
+        inspector = inspect(db.engine)
+        columns = {column['name'] for column in inspector.get_columns('attendance_session')}
+        assert {'present_bitmap', 'present_outside_ids'} <= columns
+        assert 'ux_attendance_session_student' in {index['name'] for index in inspector.get_indexes('attendance')}
+        assert db.session.query(attendease.Attendance).filter_by(session_id=session_id).count() == 1
+
+        # Running it again on an up-to-date schema changes nothing
+        attendease.migrate_database()
+        assert db.session.query(attendease.Attendance).filter_by(session_id=session_id).count() == 1